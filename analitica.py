@@ -0,0 +1,229 @@
+# analitica.py
+"""
+Analítica entre activos: correlaciones, beta a BTC, fuerza relativa y régimen de volatilidad.
+
+Todas las monedas se alinean en una única matriz (tiempo x moneda) y las métricas se
+calculan con operaciones vectorizadas de NumPy/pandas, sin bucles por pares.
+Los resultados se cachean por vela guardada: se recalculan cuando la última vela de
+alguna moneda cambia en Supabase (nueva vela ingestada, vela abierta revisada o una
+moneda rezagada que se pone al día), no por reloj.
+"""
+import os, logging, threading
+import numpy as np, pandas as pd
+from datetime import datetime, timedelta, timezone
+
+from historicos import SUPABASE_URL, _fetch_supabase_paginado
+
+logger = logging.getLogger("analitica")
+
+# ============================
+# Config
+REFERENCIA = os.getenv("ANALITICA_REFERENCIA", "BTC")
+DIAS_1H = int(os.getenv("ANALITICA_DIAS_1H", 30))
+DIAS_1D = int(os.getenv("ANALITICA_DIAS_1D", 365))
+
+TABLAS = {"1h": "ohlcv_historicos", "1d": "ohlcv_historicos_dias"}
+MAX_CACHE = 32
+VENTANAS = {"1h": 24 * 7, "1d": 30}            # velas de la ventana móvil por defecto
+LOOKBACK_FUERZA = {"1h": 24, "1d": 7}          # velas para el rendimiento de fuerza relativa
+VELAS_POR_ANIO = {"1h": 24 * 365, "1d": 365}
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+# ============================
+# Carga y alineado
+def _cargar_cierres(monedas: list, timeframe: str) -> pd.DataFrame:
+    """Cierres de todas las monedas en una sola consulta (paginada)."""
+    dias = DIAS_1H if timeframe == "1h" else DIAS_1D
+    desde = (datetime.now(timezone.utc) - timedelta(days=dias)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    url = (f"{SUPABASE_URL}/rest/v1/{TABLAS[timeframe]}"
+           f"?select=nombre,time_open,close"
+           f"&nombre=in.({','.join(monedas)})"
+           f"&time_open=gte.{desde}"
+           f"&order=time_open.asc,nombre.asc")
+    return pd.DataFrame(_fetch_supabase_paginado(url))
+
+def _desde_marca(df: pd.DataFrame) -> str:
+    """Última vela de la moneda más rezagada: desde ahí se cubre la última fila de cada moneda."""
+    ultimas = pd.to_datetime(df["time_open"], utc=True).groupby(df["nombre"]).max()
+    return ultimas.min().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def _marca_datos(filas: list, desde: str) -> tuple:
+    """
+    Huella de las filas con time_open >= `desde`: incluye la última vela de cada moneda,
+    así que cambia si cualquier moneda ingesta una vela nueva o revisa la última.
+    """
+    return tuple(sorted((f["nombre"], f["time_open"], f["close"]) for f in filas
+                        if pd.Timestamp(f["time_open"]) >= pd.Timestamp(desde)))
+
+def _marca_actual(monedas: list, timeframe: str, desde: str) -> tuple:
+    """Consulta ligera: solo las filas con time_open >= `desde` (pocas por moneda si ninguna va muy rezagada)."""
+    url = (f"{SUPABASE_URL}/rest/v1/{TABLAS[timeframe]}"
+           f"?select=nombre,time_open,close"
+           f"&nombre=in.({','.join(monedas)})"
+           f"&time_open=gte.{desde}"
+           f"&order=time_open.asc,nombre.asc")
+    return _marca_datos(_fetch_supabase_paginado(url), desde)
+
+def _matriz(df: pd.DataFrame, monedas: list) -> pd.DataFrame:
+    if df.empty:
+        return pd.DataFrame(columns=monedas)
+    df = df.copy()
+    df["time_open"] = pd.to_datetime(df["time_open"], utc=True)
+    df["close"] = pd.to_numeric(df["close"], errors="coerce")
+    matriz = df.pivot_table(index="time_open", columns="nombre", values="close", aggfunc="last")
+    return matriz.reindex(columns=monedas).sort_index().ffill()
+
+def matriz_cierres(monedas: list, timeframe: str = "1h") -> pd.DataFrame:
+    """Matriz (time_open x moneda) de cierres alineados; los huecos se rellenan hacia delante."""
+    return _matriz(_cargar_cierres(monedas, timeframe), monedas)
+
+# ============================
+# Métricas (vectorizadas)
+def _momentos(ventana: np.ndarray) -> tuple:
+    """
+    Momentos por pares con NaN tolerados (cada par usa las filas que tiene en común).
+    Devuelve (n, cov, var): n[i, j] filas comunes, cov[i, j] co-momento de i y j,
+    var[i, j] momento de i sobre las filas comunes con j (todos sin dividir por n).
+    """
+    valido = ~np.isnan(ventana)
+    x = np.where(valido, ventana, 0.0)
+    m = valido.astype(float)
+    n = m.T @ m                                   # observaciones comunes por par
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sx = x.T @ m                              # sum(x_i) sobre filas comunes con j
+        sxx = (x * x).T @ m
+        sxy = x.T @ x
+        cov = sxy - sx * sx.T / n
+        var = sxx - sx * sx / n
+    return n, cov, var
+
+def _correlacion(ventana: np.ndarray) -> np.ndarray:
+    """Matriz de correlación N x N con NaN tolerados (cada par usa las filas que tiene en común)."""
+    n, cov, var = _momentos(ventana)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        corr = cov / np.sqrt(var * var.T)
+    corr[n < 3] = np.nan
+    return np.clip(corr, -1.0, 1.0)
+
+def calcular_analitica(cierres: pd.DataFrame, timeframe: str = "1h", ventana: int = None,
+                       referencia: str = REFERENCIA) -> dict:
+    ventana = ventana or VENTANAS[timeframe]
+    monedas = list(cierres.columns)
+    precios = cierres.to_numpy(dtype=float)
+    if len(precios) < 3:
+        return {"monedas": monedas, "correlacion": {}, "por_moneda": {}}
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rend = np.diff(np.log(precios), axis=0)
+    rend[~np.isfinite(rend)] = np.nan
+    r = pd.DataFrame(rend, index=cierres.index[1:], columns=monedas)
+    w = min(ventana, len(r))
+    minimo = max(3, w // 2)
+
+    # Correlación de la última ventana (N x N)
+    n, cov, var = _momentos(rend[-w:])
+    corr = _correlacion(rend[-w:])
+
+    # Beta y correlación respecto a la referencia, sobre la misma última ventana
+    if referencia in monedas:
+        k = monedas.index(referencia)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            beta = cov[:, k] / var[k, :]              # var de la referencia sobre las filas comunes con cada moneda
+        beta[n[:, k] < minimo] = np.nan
+        corr_ref = np.where(n[:, k] < minimo, np.nan, corr[:, k])
+    else:
+        beta = corr_ref = np.full(len(monedas), np.nan)
+
+    # Fuerza relativa: rendimiento en el lookback y ranking (1 = más fuerte)
+    lookback = min(LOOKBACK_FUERZA[timeframe], len(precios) - 1)
+    rendimiento = pd.Series(precios[-1] / precios[-1 - lookback] - 1.0, index=monedas)
+    rank_fuerza = rendimiento.rank(ascending=False, method="min")
+
+    # Régimen de volatilidad: percentil de la volatilidad actual dentro de su propio histórico
+    vol = r.rolling(w, min_periods=minimo).std() * np.sqrt(VELAS_POR_ANIO[timeframe])
+    vol_hist = vol.to_numpy()
+    vol_actual = vol_hist[-1]
+    with np.errstate(invalid="ignore"):
+        percentil = np.nansum(vol_hist <= vol_actual, axis=0) / np.sum(~np.isnan(vol_hist), axis=0)
+    regimen = np.select([np.isnan(vol_actual), percentil >= 0.8, percentil <= 0.2],
+                        [None, "ALTA", "BAJA"], default="NORMAL")
+
+    por_moneda = {}
+    for i, m in enumerate(monedas):
+        por_moneda[m] = {
+            "corr_referencia": _num(corr_ref[i]),
+            "beta_referencia": _num(beta[i]),
+            "rendimiento": _num(rendimiento.iloc[i]),
+            "rank_fuerza_relativa": _num(rank_fuerza.iloc[i]),
+            "volatilidad_anual": _num(vol_actual[i]),
+            "percentil_volatilidad": _num(percentil[i]),
+            "regimen_volatilidad": regimen[i],
+        }
+
+    return {
+        "monedas": monedas,
+        "referencia": referencia,
+        "ventana": w,
+        "vela": cierres.index[-1].strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "correlacion": {m: {n: _num(corr[i, j]) for j, n in enumerate(monedas)} for i, m in enumerate(monedas)},
+        "por_moneda": por_moneda,
+    }
+
+def _num(v):
+    return None if v is None or pd.isna(v) else round(float(v), 6)
+
+# ============================
+# API con caché por vela
+def analitica(monedas: list, timeframe: str = "1h", ventana: int = None) -> dict:
+    """
+    Analítica entre activos, cacheada mientras no cambien las velas guardadas.
+    Cada petición hace una consulta ligera de la última vela de cada moneda; solo si difiere se recarga la matriz.
+    """
+    monedas = [m.strip().upper() for m in monedas if m.strip()]
+    if REFERENCIA not in monedas:
+        monedas = [REFERENCIA] + monedas
+    clave = (timeframe, ventana, tuple(monedas))
+
+    with _cache_lock:
+        guardado = _cache.get(clave)
+    if guardado and _marca_actual(monedas, timeframe, guardado[0]) == guardado[1]:
+        return guardado[2]
+
+    filas = _cargar_cierres(monedas, timeframe)
+    cierres = _matriz(filas, monedas)
+    resultado = {"timeframe": timeframe, **calcular_analitica(cierres, timeframe, ventana)}
+    if cierres.empty:
+        return resultado
+
+    desde = _desde_marca(filas)
+    marca = _marca_datos(filas.to_dict(orient="records"), desde)
+    with _cache_lock:
+        _cache.pop(clave, None)
+        _cache[clave] = (desde, marca, resultado)
+        while len(_cache) > MAX_CACHE:
+            del _cache[next(iter(_cache))]
+    return resultado
+
+def texto_analitica(monedas: list, timeframe: str = "1h") -> str:
+    """Sección Markdown para el resumen de Telegram."""
+    try:
+        datos = analitica(monedas, timeframe)
+    except Exception as e:
+        logger.error(f"Error en analítica entre activos: {e}")
+        return ""
+    if not datos.get("por_moneda"):
+        return ""
+
+    msg = f"🔗 *Contexto de mercado ({timeframe}, vs {datos['referencia']}):*\n"
+    for m, d in sorted(datos["por_moneda"].items(), key=lambda x: x[1]["rank_fuerza_relativa"] or 1e9):
+        if m == datos["referencia"]:
+            beta_txt = "ref."
+        else:
+            beta_txt = "N/A" if d["beta_referencia"] is None else f"β {d['beta_referencia']:.2f}"
+            if d["corr_referencia"] is not None:
+                beta_txt += f", ρ {d['corr_referencia']:.2f}"
+        rend_txt = "N/A" if d["rendimiento"] is None else f"{d['rendimiento'] * 100:+.2f}%"
+        msg += f"• *{m}:* {rend_txt} ({beta_txt}) · vol {d['regimen_volatilidad'] or 'N/A'}\n"
+    return msg + "\n"
@@ -0,0 +1,203 @@
+# artefactos.py
+"""
+Artefactos pre-renderizados (gráfico PNG y texto de resumen por moneda).
+
+Tras cada ingesta correcta (1h o 1d) se renderizan y se guardan como ficheros
+direccionados por contenido (nombre = sha256). Los endpoints sirven el fichero tal
+cual (sendfile vía wsgi.file_wrapper) y Telegram sube esos mismos bytes, sin volver
+a consultar Supabase ni renderizar. Un artefacto generado antes de la última ingesta
+correcta de su moneda (estado del planificador) se considera ausente y se renderiza al
+vuelo; sin estado de ingesta se caduca por edad (MAX_EDAD_SEG).
+"""
+import os, json, hashlib, logging, tempfile, threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows (desarrollo local): solo se serializa dentro del proceso
+    fcntl = None
+
+from historicos import generar_grafico, analizar_moneda_completo, ingesta_correcta
+
+logger = logging.getLogger("artefactos")
+
+# ============================
+# Config
+ARTEFACTOS_DIR = os.getenv("ARTEFACTOS_DIR",
+                           os.path.join(tempfile.gettempdir(), "monitor_criptos_artefactos"))
+VENTANAS = [int(d) for d in os.getenv("ARTEFACTOS_VENTANAS", "30").split(",") if d.strip()]
+MAX_EDAD_SEG = int(os.getenv("ARTEFACTOS_MAX_EDAD_SEG", 3600 + 900))  # solo sin estado de ingesta
+
+_locks_proceso = {}
+_locks_proceso_mutex = threading.Lock()
+
+# ============================
+# Almacenamiento
+def _dir(sub: str) -> str:
+    ruta = os.path.join(ARTEFACTOS_DIR, sub)
+    os.makedirs(ruta, exist_ok=True)
+    return ruta
+
+def _escribir_atomico(ruta: str, datos: bytes):
+    tmp = f"{ruta}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(datos)
+    os.replace(tmp, ruta)
+
+def _guardar_objeto(datos: bytes, ext: str) -> str:
+    """Guarda `datos` como objeto direccionado por contenido y devuelve su hash."""
+    h = hashlib.sha256(datos).hexdigest()
+    ruta = os.path.join(_dir("objetos"), f"{h}.{ext}")
+    if not os.path.exists(ruta):
+        _escribir_atomico(ruta, datos)
+    return h
+
+def _ruta_indice(moneda: str, dias: int) -> str:
+    return os.path.join(_dir("indice"), f"{moneda}_{dias}d.json")
+
+def leer_indice(moneda: str, dias: int) -> dict:
+    try:
+        with open(_ruta_indice(moneda, dias), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _ultima_ingesta(moneda: str):
+    """Inicio de la última ingesta correcta (1h o 1d) de `moneda` según el planificador, o None."""
+    from planificador import leer_estado   # import diferido: planificador importa este módulo
+    fechas = [leer_estado(moneda, tf).get("ultima_correcta") for tf in ("1h", "1d")]
+    return max((f for f in fechas if f), default=None)
+
+def _indice_vigente(moneda: str, dias: int) -> dict:
+    """
+    Índice de (moneda, dias) si sigue vigente: generado después de la última ingesta correcta,
+    que es lo único que cambia los datos. Sin estado de ingesta, caduca a los MAX_EDAD_SEG.
+    """
+    indice = leer_indice(moneda, dias)
+    if "generado" not in indice:
+        return {}
+    ingesta = _ultima_ingesta(moneda)
+    if ingesta is not None:
+        if indice["generado"] < ingesta:
+            logger.info(f"{moneda}: artefacto de {dias}d anterior a la ingesta de {ingesta}, se renderiza al vuelo")
+            return {}
+        return indice
+
+    logger.info(f"{moneda}: sin estado de ingesta, el artefacto de {dias}d caduca por edad ({MAX_EDAD_SEG}s)")
+    try:
+        generado = datetime.strptime(indice["generado"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return {}
+    edad = (datetime.now(timezone.utc) - generado).total_seconds()
+    if edad > MAX_EDAD_SEG:
+        logger.info(f"{moneda}: artefacto de {dias}d caducado ({edad:.0f}s), se renderiza al vuelo")
+        return {}
+    return indice
+
+def _hashes_referenciados() -> set:
+    usados = set()
+    for nombre in os.listdir(_dir("indice")):
+        if not nombre.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(_dir("indice"), nombre), "r", encoding="utf-8") as f:
+                indice = json.load(f)
+        except (OSError, ValueError):
+            continue
+        usados.update(v for k, v in indice.items() if k in ("png", "texto"))
+    return usados
+
+def _limpiar_objetos(candidatos: set):
+    """Borra objetos antiguos que ya no referencia ningún índice."""
+    huerfanos = candidatos - _hashes_referenciados()
+    for nombre in os.listdir(_dir("objetos")):
+        if nombre.split(".")[0] in huerfanos:
+            try:
+                os.remove(os.path.join(_dir("objetos"), nombre))
+            except OSError:
+                pass
+
+@contextmanager
+def _lock_moneda(moneda: str):
+    """
+    Lock exclusivo (bloqueante) por moneda, válido entre hilos y procesos.
+    Las ingestas 1h y 1d de una moneda tienen leases distintos y pueden pre-renderizar a la vez:
+    sin serializar, ambas leen el mismo índice anterior y el objeto de una queda huérfano.
+    """
+    with _locks_proceso_mutex:
+        lock = _locks_proceso.setdefault(moneda, threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(os.path.join(_dir("locks"), f"{moneda}.lock"), os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+# ============================
+# Pre-render
+def prerender(moneda: str, ventanas: list = None) -> dict:
+    """Renderiza gráfico y texto de `moneda` para cada ventana y actualiza los índices (serializado por moneda)."""
+    with _lock_moneda(moneda):
+        return _prerender(moneda, ventanas)
+
+def _prerender(moneda: str, ventanas: list = None) -> dict:
+    texto = analizar_moneda_completo(moneda)
+    h_texto = _guardar_objeto(texto.encode("utf-8"), "txt")
+
+    generados = {}
+    for dias in ventanas or VENTANAS:
+        buf = generar_grafico(moneda, dias=dias)
+        if buf is None:
+            logger.warning(f"{moneda}: sin datos para pre-renderizar el gráfico de {dias}d")
+            continue
+        anterior = leer_indice(moneda, dias)
+        indice = {
+            "png": _guardar_objeto(buf.getvalue(), "png"),
+            "texto": h_texto,
+            "generado": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+        _escribir_atomico(_ruta_indice(moneda, dias), json.dumps(indice).encode("utf-8"))
+        _limpiar_objetos({anterior.get("png"), anterior.get("texto")} - {None})
+        generados[dias] = indice["png"]
+
+    logger.info(f"{moneda}: artefactos pre-renderizados {generados}")
+    return generados
+
+def prerender_tras_ingesta(moneda: str, *resultados) -> None:
+    """
+    Pre-renderiza si alguna de las ingestas (1h y/o 1d) fue correcta; un fallo aquí no invalida la ingesta.
+    Tras la 1d también se regenera, porque el texto usa los datos diarios (ATH/ATL).
+    """
+    if not any(ingesta_correcta(r) and not (isinstance(r, dict) and "omitido" in r) for r in resultados):
+        return
+    try:
+        prerender(moneda)
+    except Exception:
+        logger.exception(f"Error pre-renderizando artefactos de {moneda}")
+
+# ============================
+# Lectura
+def ruta_grafico(moneda: str, dias: int):
+    """(ruta, hash) del PNG pre-renderizado, o (None, None) si no existe."""
+    h = _indice_vigente(moneda, dias).get("png")
+    if not h:
+        return None, None
+    ruta = os.path.join(ARTEFACTOS_DIR, "objetos", f"{h}.png")
+    return (ruta, h) if os.path.exists(ruta) else (None, None)
+
+def texto_moneda(moneda: str, dias: int = None):
+    """Texto de resumen pre-renderizado de `moneda`, o None si no existe o ha caducado."""
+    h = _indice_vigente(moneda, dias or VENTANAS[0]).get("texto")
+    if not h:
+        return None
+    try:
+        with open(os.path.join(ARTEFACTOS_DIR, "objetos", f"{h}.txt"), "r", encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
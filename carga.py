@@ -0,0 +1,385 @@
+# carga.py
+"""
+Prueba de carga / soak de los endpoints Flask bajo el modelo de workers de producción.
+
+Arranca gunicorn (como en render.yaml) contra backends locales simulados
+(Supabase falso en un servidor HTTP local y exchange sintético, sin Telegram),
+lanza una mezcla configurable de peticiones a /resumen, /grafico,
+/historicos_auto y /health, y reporta throughput, percentiles de latencia,
+tasas de error/timeout, reinicios de workers y RSS por worker (con pendiente
+MB/h para detectar fugas de matplotlib/pandas en soaks largos).
+
+Los timeouts se separan en dos: `timeout` (el cliente se cansa de esperar) y
+`timeout_worker` (gunicorn mata al worker con -t: la conexión se corta o el
+worker responde un 500 genérico al abortar; se detecta porque el error coincide
+con la caída de un worker).
+
+Uso:
+    python carga.py --configs sync:2 --duracion 60 --concurrencia 8
+    python carga.py --configs sync:2,gthread:2:4 --mezcla resumen=2,grafico=5,historicos_auto=1,health=2
+    python carga.py --configs sync:2 --duracion 3600 --json soak.json     # soak de 1 h
+
+Cada config es clase:workers[:threads]. Solo Linux (RSS leído de /proc).
+"""
+import os, re, sys, json, time, zlib, random, socket, signal, argparse, logging, tempfile, threading, subprocess
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np, pandas as pd, requests
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger("carga")
+
+MONEDAS = ["BTC", "ETH", "ADA", "SHIB", "SOL"]
+MEZCLA_DEFECTO = "resumen=2,grafico=5,historicos_auto=1,health=2"
+MIN_SEG_PENDIENTE = 60   # tramo mínimo para estimar la pendiente de RSS (MB/h)
+MARGEN_CAIDA_SEG = 1.0   # holgura al casar un error de conexión con la caída de un worker
+RUTAS = {
+    "resumen": lambda: "/resumen",
+    "grafico": lambda: f"/grafico?moneda={random.choice(MONEDAS)}",
+    "historicos_auto": lambda: f"/historicos_auto?moneda={random.choice(MONEDAS)}&dias=7&dias_dias=90",
+    "health": lambda: "/health",
+}
+
+# ============================
+# 🔹 Datos sintéticos (compartidos por el Supabase falso y el exchange falso)
+def _velas_sinteticas(moneda: str, timeframe: str, dias: int) -> pd.DataFrame:
+    freq = "1h" if timeframe == "1h" else "1d"
+    fin = pd.Timestamp.now(tz="UTC").floor("h" if timeframe == "1h" else "d")
+    idx = pd.date_range(end=fin, periods=dias * (24 if timeframe == "1h" else 1), freq=freq)
+    rng = np.random.default_rng(zlib.crc32(f"{moneda}{timeframe}".encode()))
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, len(idx))))
+    return pd.DataFrame({
+        "nombre": moneda,
+        "time_open": idx,
+        "time_close": idx + pd.to_timedelta(freq),
+        "open": close * (1 + rng.normal(0, 0.002, len(idx))),
+        "high": close * 1.005,
+        "low": close * 0.995,
+        "close": close,
+        "volume": rng.uniform(10, 1000, len(idx)),
+        "fuente": "simulado",
+    })
+
+# ============================
+# 🔹 Supabase falso (PostgREST mínimo: GET con eq/in/gte/limit/offset, POST que acepta todo)
+class _SupabaseFalso(BaseHTTPRequestHandler):
+    cache = {}
+    latencia_seg = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def _filas(self, tabla: str, moneda: str) -> list:
+        clave = (tabla, moneda)
+        if clave not in self.cache:
+            tf = "1d" if tabla.endswith("_dias") else "1h"
+            df = _velas_sinteticas(moneda, tf, 365 if tf == "1d" else 30)
+            from historicos import _add_indicadores
+            df = _add_indicadores(df)
+            df["time_open"] = df["time_open"].dt.strftime("%Y-%m-%dT%H:%M:%S+00:00")
+            df["time_close"] = df["time_close"].dt.strftime("%Y-%m-%dT%H:%M:%S+00:00")
+            self.cache[clave] = df.to_dict(orient="records")
+        return self.cache[clave]
+
+    def _responder(self, codigo: int, cuerpo):
+        datos = json.dumps(cuerpo).encode()
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def do_GET(self):
+        time.sleep(self.latencia_seg)
+        url = urlparse(self.path)
+        tabla = url.path.rsplit("/", 1)[-1]
+        q = parse_qs(url.query)
+        nombre = q.get("nombre", ["eq.BTC"])[0]
+        if nombre.startswith("in.("):
+            monedas = nombre[4:-1].split(",")
+        else:
+            monedas = [nombre.split(".", 1)[-1]]
+        filas = [f for m in monedas for f in self._filas(tabla, m)]
+        if "time_open" in q and q["time_open"][0].startswith("gte."):
+            desde = pd.Timestamp(q["time_open"][0][4:]).strftime("%Y-%m-%dT%H:%M:%S+00:00")
+            filas = [f for f in filas if f["time_open"] >= desde]
+        if "select" in q:
+            campos = q["select"][0].split(",")
+            filas = [{c: f.get(c) for c in campos} for f in filas]
+        offset = int(q.get("offset", [0])[0])
+        limite = int(q.get("limit", [len(filas)])[0])
+        self._responder(200, filas[offset:offset + limite])
+
+    def do_POST(self):
+        time.sleep(self.latencia_seg)
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._responder(201, [])
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def iniciar_supabase_falso(latencia_ms: int = 0):
+    _SupabaseFalso.latencia_seg = latencia_ms / 1000
+    servidor = ThreadingHTTPServer(("127.0.0.1", _puerto_libre()), _SupabaseFalso)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}"
+
+# ============================
+# 🔹 App para gunicorn con exchange simulado: gunicorn 'carga:crear_app()'
+def crear_app():
+    import historicos
+    from monitor_criptos import app
+
+    latencia = int(os.getenv("CARGA_LATENCIA_EXCHANGE_MS", 200)) / 1000
+
+    def obtener_historicos_kraken_simulado(moneda, dias, timeframe="1h"):
+        time.sleep(latencia)
+        return _velas_sinteticas(moneda, timeframe, dias)
+
+    historicos.obtener_historicos_kraken = obtener_historicos_kraken_simulado
+    return app
+
+# ============================
+# 🔹 Gunicorn + RSS por worker
+def _rss_mb(pid: int):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            m = re.search(r"VmRSS:\s+(\d+) kB", f.read())
+        return int(m.group(1)) / 1024 if m else None
+    except OSError:
+        return None
+
+def _hijos(pid: int) -> list:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+def arrancar_gunicorn(clase: str, workers: int, threads: int, timeout: int, env: dict):
+    puerto = _puerto_libre()
+    cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+           "-w", str(workers), "-k", clase, "-t", str(timeout),
+           "-b", f"127.0.0.1:{puerto}", "--log-level", "warning"]
+    if threads:
+        cmd += ["--threads", str(threads)]
+    cmd.append("carga:crear_app()")
+    proc = subprocess.Popen(cmd, env={**os.environ, **env}, cwd=os.path.dirname(os.path.abspath(__file__)))
+    base = f"http://127.0.0.1:{puerto}"
+    limite = time.time() + 60
+    while time.time() < limite:
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn terminó al arrancar (código {proc.returncode})")
+        try:
+            if requests.get(f"{base}/health", timeout=2).ok:
+                return proc, base
+        except requests.RequestException:
+            time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError("gunicorn no respondió a /health en 60 s")
+
+# ============================
+# 🔹 Generador de carga
+def _parsear_mezcla(mezcla: str) -> dict:
+    pesos = {}
+    for parte in mezcla.split(","):
+        nombre, _, peso = parte.partition("=")
+        if nombre.strip() not in RUTAS:
+            raise ValueError(f"endpoint desconocido en la mezcla: {nombre}")
+        pesos[nombre.strip()] = float(peso or 1)
+    return pesos
+
+def _cliente(base: str, pesos: dict, fin: float, timeout_cliente: float, resultados: list, lock):
+    nombres, w = list(pesos), list(pesos.values())
+    sesion = requests.Session()
+    while time.time() < fin:
+        ep = random.choices(nombres, weights=w)[0]
+        inicio = time.perf_counter()
+        estado = None
+        try:
+            r = sesion.get(base + RUTAS[ep](), timeout=timeout_cliente)
+            estado = "ok" if r.status_code < 400 else f"http_{r.status_code}"
+        except requests.Timeout:
+            estado = "timeout"
+        except requests.RequestException:
+            estado = "error_conexion"
+        with lock:
+            resultados.append((ep, time.perf_counter() - inicio, estado, time.time()))
+
+def _muestrear_rss(master: int, parar, intervalo: float, muestras: list, vistos: set, caidas: list):
+    """Muestrea RSS por worker y anota en `caidas` el intervalo (t0, t1) en que desapareció cada uno."""
+    anteriores, t_anterior = set(), time.time()
+    while True:
+        final = parar.is_set()   # tras `parar` se toma una última muestra para ver las últimas caídas
+        t = time.time()
+        actuales = set(_hijos(master))
+        caidas.extend((t_anterior, t) for _ in anteriores - actuales)
+        for pid in actuales:
+            vistos.add(pid)
+            rss = _rss_mb(pid)
+            if rss is not None:
+                muestras.append((t, pid, rss))
+        anteriores, t_anterior = actuales, t
+        if final:
+            break
+        parar.wait(intervalo)
+
+def _clasificar_caidas(resultados: list, caidas: list) -> list:
+    """Un corte de conexión o 500 que coincide con la caída de un worker es un timeout de worker (-t)."""
+    def coincide(t):
+        return any(t0 - MARGEN_CAIDA_SEG <= t <= t1 + MARGEN_CAIDA_SEG for t0, t1 in caidas)
+    return [(ep, lat, "timeout_worker" if estado in ("error_conexion", "http_500") and coincide(t) else estado, t)
+            for ep, lat, estado, t in resultados]
+
+def _resumen_latencias(filas: list, duracion: float) -> dict:
+    lat = np.array([f[1] for f in filas]) * 1000
+    estados = [f[2] for f in filas]
+    n = len(filas)
+    if not n:
+        return {"peticiones": 0}
+    p50, p90, p95, p99 = (float(v) for v in np.percentile(lat, [50, 90, 95, 99]))
+    return {
+        "peticiones": n,
+        "rps": round(n / duracion, 2),
+        "p50_ms": round(p50, 1), "p90_ms": round(p90, 1), "p95_ms": round(p95, 1), "p99_ms": round(p99, 1),
+        "max_ms": round(float(lat.max()), 1),
+        "tasa_error": round(sum(e not in ("ok", "timeout", "timeout_worker") for e in estados) / n, 4),
+        "tasa_timeout": round(estados.count("timeout") / n, 4),
+        "tasa_timeout_worker": round(estados.count("timeout_worker") / n, 4),
+        "errores": {e: estados.count(e) for e in set(estados) if e != "ok"},
+    }
+
+def _resumen_rss(muestras: list) -> dict:
+    por_pid = {}
+    for t, pid, rss in muestras:
+        por_pid.setdefault(pid, []).append((t, rss))
+    salida = {}
+    for pid, serie in por_pid.items():
+        t = np.array([s[0] for s in serie])
+        rss = np.array([s[1] for s in serie])
+        # La pendiente se ajusta sobre la segunda mitad (la primera es calentamiento: imports, cachés)
+        mitad = len(serie) // 2
+        t2, rss2 = t[mitad:], rss[mitad:]
+        pendiente = None
+        if len(t2) >= 3 and t2[-1] - t2[0] >= MIN_SEG_PENDIENTE:
+            pendiente = np.polyfit((t2 - t2[0]) / 3600, rss2, 1)[0]
+        salida[str(pid)] = {
+            "rss_inicial_mb": round(float(rss[0]), 1), "rss_final_mb": round(float(rss[-1]), 1),
+            "rss_max_mb": round(float(rss.max()), 1),
+            "pendiente_mb_h": None if pendiente is None else round(float(pendiente), 1),
+        }
+    return salida
+
+def ejecutar_config(config: str, args, supabase_url: str) -> dict:
+    partes = config.split(":")
+    clase, workers = partes[0], int(partes[1]) if len(partes) > 1 else 2
+    threads = int(partes[2]) if len(partes) > 2 else 0
+    tmp = tempfile.mkdtemp(prefix="carga_")
+    env = {
+        "SUPABASE_URL": supabase_url, "SUPABASE_KEY": "simulado",
+        "TELEGRAM_TOKEN": "", "TELEGRAM_CHAT_ID": "", "PLANIFICADOR": "false",
+        "PLANIFICADOR_DIR": os.path.join(tmp, "planificador"),
+        "ARTEFACTOS_DIR": os.path.join(tmp, "artefactos"),
+        "CARGA_LATENCIA_EXCHANGE_MS": str(args.latencia_exchange_ms),
+        "MONEDAS": ",".join(MONEDAS), "MPLBACKEND": "Agg",
+    }
+    logger.info(f"▶ Config {config}: {args.concurrencia} clientes durante {args.duracion}s")
+    proc, base = arrancar_gunicorn(clase, workers, threads, args.timeout, env)
+    try:
+        resultados, lock = [], threading.Lock()
+        muestras, vistos, caidas = [], set(), []
+        inicio = time.time()
+        fin = inicio + args.duracion
+        pesos = _parsear_mezcla(args.mezcla)
+        # El muestreo sigue hasta que acaba la última petición, que puede pasar de `fin` hasta el timeout
+        parar = threading.Event()
+        muestreo = threading.Thread(target=_muestrear_rss,
+                                    args=(proc.pid, parar, args.intervalo_rss, muestras, vistos, caidas))
+        hilos = [threading.Thread(target=_cliente, args=(base, pesos, fin, args.timeout_cliente, resultados, lock))
+                 for _ in range(args.concurrencia)]
+        muestreo.start()
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+        duracion = time.time() - inicio
+        time.sleep(MARGEN_CAIDA_SEG)   # deja que el master recoja un worker abortado al final
+        parar.set()
+        muestreo.join()
+        resultados = _clasificar_caidas(resultados, caidas)
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    return {
+        "config": {"clase": clase, "workers": workers, "threads": threads or None, "timeout": args.timeout},
+        "duracion_seg": round(duracion, 1),
+        "concurrencia": args.concurrencia,
+        "total": _resumen_latencias(resultados, duracion),
+        "por_endpoint": {ep: _resumen_latencias([r for r in resultados if r[0] == ep], duracion)
+                         for ep in sorted({r[0] for r in resultados})},
+        "reinicios_workers": max(0, len(vistos) - workers),
+        "rss_workers": _resumen_rss(muestras),
+    }
+
+def _imprimir(informe: dict):
+    c = informe["config"]
+    print(f"\n=== {c['clase']} x{c['workers']}" + (f" ({c['threads']} threads)" if c["threads"] else "") +
+          f" · {informe['concurrencia']} clientes · {informe['duracion_seg']}s ===")
+    print(f"{'endpoint':<16}{'n':>7}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'err%':>7}{'tout%':>7}"
+          f"{'wtout%':>8}")
+    for ep, r in {**informe["por_endpoint"], "TOTAL": informe["total"]}.items():
+        if not r.get("peticiones"):
+            continue
+        print(f"{ep:<16}{r['peticiones']:>7}{r['rps']:>8}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}"
+              f"{r['max_ms']:>9}{r['tasa_error'] * 100:>7.2f}{r['tasa_timeout'] * 100:>7.2f}"
+              f"{r['tasa_timeout_worker'] * 100:>8.2f}")
+    print(f"Reinicios de workers: {informe['reinicios_workers']}")
+    for pid, r in informe["rss_workers"].items():
+        print(f"  worker {pid}: RSS {r['rss_inicial_mb']} → {r['rss_final_mb']} MB "
+              f"(máx {r['rss_max_mb']}, pendiente {r['pendiente_mb_h']} MB/h)")
+
+# ============================
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Prueba de carga/soak de monitor_criptos bajo gunicorn")
+    p.add_argument("--configs", default="sync:2", help="lista clase:workers[:threads] separada por comas")
+    p.add_argument("--mezcla", default=MEZCLA_DEFECTO, help="pesos endpoint=peso separados por comas")
+    p.add_argument("--duracion", type=int, default=60, help="segundos por config")
+    p.add_argument("--concurrencia", type=int, default=8, help="clientes simultáneos")
+    p.add_argument("--timeout", type=int, default=300, help="timeout de worker de gunicorn (-t)")
+    p.add_argument("--timeout-cliente", type=float, default=None,
+                   help="timeout HTTP del cliente (por defecto --timeout + 30, para ver los timeouts de worker)")
+    p.add_argument("--latencia-exchange-ms", type=int, default=200, help="latencia simulada del exchange")
+    p.add_argument("--latencia-supabase-ms", type=int, default=20, help="latencia simulada de Supabase")
+    p.add_argument("--intervalo-rss", type=float, default=5, help="segundos entre muestras de RSS")
+    p.add_argument("--json", help="guarda el informe completo en este fichero")
+    args = p.parse_args(argv)
+    if args.timeout_cliente is None:
+        args.timeout_cliente = args.timeout + 30
+    elif args.timeout_cliente <= args.timeout:
+        logger.warning("--timeout-cliente <= --timeout: los timeouts de worker se contarán como timeouts del cliente")
+
+    servidor, supabase_url = iniciar_supabase_falso(args.latencia_supabase_ms)
+    informes = []
+    try:
+        for config in [c.strip() for c in args.configs.split(",") if c.strip()]:
+            informe = ejecutar_config(config, args, supabase_url)
+            _imprimir(informe)
+            informes.append(informe)
+    finally:
+        servidor.shutdown()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"generado": datetime.now(timezone.utc).isoformat(), "informes": informes}, f, indent=2)
+        logger.info(f"Informe guardado en {args.json}")
+    return informes
+
+if __name__ == "__main__":
+    main()
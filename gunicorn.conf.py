@@ -0,0 +1,13 @@
+# gunicorn.conf.py
+"""
+Hooks de gunicorn para monitor_criptos.
+
+El planificador de ingesta se arranca en cada worker ya inicializado, no al importar
+el módulo: así los procesos de render del dashboard (forkserver/spawn), que re-importan
+__main__, no arrancan planificadores propios.
+"""
+
+
+def post_worker_init(worker):
+    from monitor_criptos import iniciar_planificador
+    iniciar_planificador()
@@ -1,5 +1,11 @@
-import pandas as pd, ccxt, os, io, requests, dotenv, numpy as np, time, json, logging, matplotlib.pyplot as plt
+import pandas as pd, ccxt, os, io, requests, dotenv, numpy as np, time, json, logging, hashlib, math, multiprocessing, threading
+import matplotlib.image as mpimg
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta, timezone
+from decimal import Decimal, ROUND_HALF_UP
 
 # ============================
 # 🔹 Configuración inicial
@@ -15,6 +21,18 @@ HEADERS = {
 }
 
 MAX_REGISTROS_POR_LOTE = 25   # 🔹 Inserción por lotes
+PAGINA_SUPABASE = 1000        # 🔹 Límite de filas por petición en PostgREST
+
+# 🔹 Diff por hash: directorio local opcional con los hashes ya guardados (evita el GET a Supabase).
+#    Un fichero por (tabla, moneda): cada uno lo escribe solo quien tiene el lease de esa moneda.
+HASHES_SIDECAR = os.getenv("OHLCV_HASHES_SIDECAR")
+COLUMNAS_HASH = ["open", "high", "low", "close", "volume"]
+MAX_HASHES_SIDECAR = 2000     # velas recordadas por (tabla, moneda)
+DECIMALES_OHLCV = int(os.getenv("OHLCV_DECIMALES", 8))   # escala de las columnas OHLCV en Supabase
+
+# 🔹 Dashboard: un proceso por moneda (el dashboard tarda lo que el gráfico más lento),
+#    con un tope explícito porque cada proceso de render carga pandas/matplotlib (~150 MB)
+DASHBOARD_MAX_PROCESOS = int(os.getenv("DASHBOARD_MAX_PROCESOS", 6))
 
 logger = logging.getLogger("historicos")
 if not logger.handlers:
@@ -41,13 +59,19 @@ KRAKEN_SYMBOLS = {
 }
 
 # ============================
-def generar_grafico(moneda: str, dias: int = 30):
-    """Genera gráfico de precios, RSI y MACD de los últimos X días"""
+def _figura_grafico(moneda: str, dias: int = 30):
+    """
+    Figura de precios, RSI y MACD de los últimos X días (None si no hay datos).
+    Sin pyplot: la figura no pasa por el estado global, así que se puede renderizar
+    a la vez desde el hilo del planificador y desde las peticiones.
+    """
     df = cargar_horas_30d(moneda)
     if df.empty:
         return None
 
-    fig, (ax1, ax2, ax3) = plt.subplots(3, 1, figsize=(10, 8), sharex=True)
+    fig = Figure(figsize=(10, 8))
+    FigureCanvasAgg(fig)
+    ax1, ax2, ax3 = fig.subplots(3, 1, sharex=True)
     fig.suptitle(f"{moneda} - Últimos {dias} días", fontsize=14)
 
     ax1.plot(df["time_open"], df["close"], label="Cierre", color="blue")
@@ -66,15 +90,102 @@ def generar_grafico(moneda: str, dias: int = 30):
     ax3.set_ylabel("MACD")
     ax3.legend()
 
-    plt.xticks(rotation=30)
-    plt.tight_layout()
+    ax3.tick_params(axis="x", labelrotation=30)
+    fig.tight_layout()
+    return fig
+
+def generar_grafico(moneda: str, dias: int = 30):
+    """Genera gráfico de precios, RSI y MACD de los últimos X días"""
+    fig = _figura_grafico(moneda, dias)
+    if fig is None:
+        return None
 
     buf = io.BytesIO()
-    plt.savefig(buf, format="png")
+    fig.savefig(buf, format="png")
     buf.seek(0)
-    plt.close(fig)
 
     return buf
+
+# ============================
+# 🔹 Dashboard multi-moneda
+_contexto_mp = None
+
+def _contexto_procesos():
+    """
+    Contexto forkserver (spawn en Windows): nunca se hace fork del worker de gunicorn,
+    que puede tener el hilo del planificador con locks tomados (logging, requests).
+    El forkserver queda vivo mientras viva el worker, así que no precarga nada: es un
+    intérprete vacío (~10 MB) y cada proceso de render importa este módulo al arrancar
+    (1-2 s frente a las decenas de segundos de un gráfico).
+    """
+    global _contexto_mp
+    if _contexto_mp is None:
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            _contexto_mp = multiprocessing.get_context("forkserver")
+            _contexto_mp.set_forkserver_preload([])
+        else:
+            _contexto_mp = multiprocessing.get_context("spawn")
+    return _contexto_mp
+
+def _grafico_dashboard(moneda: str, dias: int, como_png: bool):
+    """Se ejecuta en el pool: devuelve PNG (bytes) o píxeles RGBA (np.ndarray) del gráfico, o None."""
+    fig = _figura_grafico(moneda, dias)
+    if fig is None:
+        return None
+    if como_png:
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png")
+        return buf.getvalue()
+    fig.canvas.draw()
+    return np.asarray(fig.canvas.buffer_rgba()).copy()
+
+def _renderizar_en_paralelo(monedas: list, dias: int, como_png: bool) -> dict:
+    # Pool por petición: al salir del `with` los procesos de render terminan y liberan su RSS
+    procesos = max(1, min(DASHBOARD_MAX_PROCESOS, len(monedas)))
+    resultados = {}
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=_contexto_procesos()) as pool:
+        futuros = {m: pool.submit(_grafico_dashboard, m, dias, como_png) for m in monedas}
+        for m, fut in futuros.items():
+            try:
+                resultados[m] = fut.result()
+            except BrokenProcessPool:
+                logger.error(f"Pool de gráficos roto renderizando {m}")
+                resultados[m] = None
+            except Exception as e:
+                logger.error(f"Error generando gráfico de {m} para dashboard: {e}")
+                resultados[m] = None
+    return resultados
+
+def generar_dashboard(monedas: list, dias: int = 30, columnas: int = 2):
+    """
+    Renderiza los gráficos de todas las monedas en paralelo y los une en una sola imagen (rejilla).
+    Devuelve (BytesIO con el PNG o None, monedas sin datos).
+    """
+    imagenes = _renderizar_en_paralelo(monedas, dias, como_png=False)
+    validas = [imagenes[m] for m in monedas if imagenes.get(m) is not None]
+    sin_datos = [m for m in monedas if imagenes.get(m) is None]
+    if not validas:
+        return None, sin_datos
+
+    alto = max(img.shape[0] for img in validas)
+    ancho = max(img.shape[1] for img in validas)
+    columnas = max(1, min(columnas, len(validas)))
+    filas = math.ceil(len(validas) / columnas)
+
+    rejilla = np.full((filas * alto, columnas * ancho, 4), 255, dtype=np.uint8)
+    for i, img in enumerate(validas):
+        f, c = divmod(i, columnas)
+        rejilla[f * alto:f * alto + img.shape[0], c * ancho:c * ancho + img.shape[1]] = img
+
+    buf = io.BytesIO()
+    mpimg.imsave(buf, rejilla, format="png")
+    buf.seek(0)
+    return buf, sin_datos
+
+def generar_graficos_png(monedas: list, dias: int = 30) -> dict:
+    """Renderiza en paralelo un PNG por moneda (para enviarlos como álbum). {moneda: bytes} sin las vacías."""
+    pngs = _renderizar_en_paralelo(monedas, dias, como_png=True)
+    return {m: pngs[m] for m in monedas if pngs.get(m) is not None}
 # ============================ # 🔹 Obtener históricos desde CoinGecko
 def obtener_historicos_coingecko(moneda, dias, timeframe="1h"):
     """ Usa CoinGecko como último recurso. 
@@ -153,9 +264,116 @@ def _add_indicadores(df: pd.DataFrame) -> pd.DataFrame:
     df["confianza"] = 1.0
     return df
 
+# ============================
+# 🔹 Diff por hash (solo se envían velas nuevas o revisadas)
+def _normalizar_valor(v) -> str:
+    """
+    Valor tal y como queda guardado: el JSON lleva repr(float) y Postgres lo redondea a
+    DECIMALES_OHLCV decimales (mitad hacia arriba). Aplicar el mismo redondeo al valor enviado
+    y al leído hace que coincidan exactamente, sin falsos cambios por doble redondeo.
+    """
+    if v is None or pd.isna(v):
+        return ""
+    escala = Decimal(1).scaleb(-DECIMALES_OHLCV)
+    valor = Decimal(repr(float(v))).quantize(escala, rounding=ROUND_HALF_UP)
+    return f"{valor + 0:f}"   # + 0 convierte -0 en 0
+
+def _hash_fila(fila: dict) -> str:
+    """Hash del contenido OHLCV de una vela (normalizado para que el redondeo de Supabase no cuente como cambio)."""
+    valores = [_normalizar_valor(fila.get(c)) for c in COLUMNAS_HASH]
+    return hashlib.sha1("|".join(valores).encode()).hexdigest()
+
+def _clave_time_open(valor) -> str:
+    return pd.to_datetime(valor, utc=True).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def _ruta_sidecar(tabla: str, moneda: str) -> str:
+    return os.path.join(HASHES_SIDECAR, f"{tabla}_{moneda}.json")
+
+def _leer_sidecar(tabla: str, moneda: str):
+    """{time_open: hash} guardado para (tabla, moneda), o None si no hay sidecar."""
+    try:
+        with open(_ruta_sidecar(tabla, moneda), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _escribir_sidecar(tabla: str, moneda: str, hashes: dict):
+    guardados = {**(_leer_sidecar(tabla, moneda) or {}), **hashes}
+    ruta = _ruta_sidecar(tabla, moneda)
+    tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(HASHES_SIDECAR, exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(dict(sorted(guardados.items())[-MAX_HASHES_SIDECAR:]), f)
+        os.replace(tmp, ruta)
+    except OSError as e:
+        logger.warning(f"No se pudo actualizar el sidecar de hashes {ruta}: {e}")
+
+def obtener_hashes_existentes(tabla: str, moneda: str, desde: str) -> dict:
+    """Devuelve {time_open: hash} de las velas ya guardadas desde `desde` (sidecar local o Supabase)."""
+    if HASHES_SIDECAR:
+        guardados = _leer_sidecar(tabla, moneda)
+        if guardados is not None:
+            return {k: v for k, v in guardados.items() if k >= desde}
+
+    url = (f"{SUPABASE_URL}/rest/v1/{tabla}"
+           f"?select=time_open,{','.join(COLUMNAS_HASH)}"
+           f"&nombre=eq.{moneda}&time_open=gte.{desde}&order=time_open.asc")
+    try:
+        filas = _fetch_supabase_paginado(url)
+    except Exception as e:
+        logger.warning(f"{moneda}: no se pudieron leer hashes de {tabla} ({e}) → se envía la ventana completa")
+        return {}
+    return {_clave_time_open(f["time_open"]): _hash_fila(f) for f in filas if "time_open" in f}
+
+def _filtrar_cambios(registros: list, tabla: str) -> tuple:
+    """Separa los registros nuevos o revisados. Devuelve (registros_a_enviar, hashes_nuevos)."""
+    if not registros:
+        return [], {}
+    moneda = registros[0]["nombre"]
+    desde = min(r["time_open"] for r in registros)
+    existentes = obtener_hashes_existentes(tabla, moneda, desde)
+
+    cambios, hashes = [], {}
+    for r in registros:
+        h = _hash_fila(r)
+        hashes[r["time_open"]] = h
+        if existentes.get(r["time_open"]) != h:
+            cambios.append(r)
+    logger.info(f"{moneda}: {len(cambios)}/{len(registros)} velas nuevas o revisadas para {tabla}")
+    return cambios, hashes
+
+def _enviar_lotes(registros: list, tabla: str, prefer: str) -> int:
+    url = f"{SUPABASE_URL}/rest/v1/{tabla}?on_conflict=nombre,time_open"
+    headers = {**HEADERS, "Prefer": prefer}
+
+    total_insertados = 0
+    for i in range(0, len(registros), MAX_REGISTROS_POR_LOTE):
+        lote = registros[i:i+MAX_REGISTROS_POR_LOTE]
+        r = requests.post(url, headers=headers, json=lote)
+        if not r.ok:
+            logger.error(f"Error insertando en {tabla}: {r.text}")
+            continue
+        total_insertados += len(lote)
+    return total_insertados
+
+def _upsert_cambios(registros: list, tabla: str) -> int:
+    """Envía solo las velas nuevas o revisadas con merge-duplicates (la vela abierta se corrige al cerrar)."""
+    cambios, hashes = _filtrar_cambios(registros, tabla)
+    if not cambios:
+        if HASHES_SIDECAR and hashes:
+            _escribir_sidecar(tabla, registros[0]["nombre"], hashes)
+        logger.info(f"Sin cambios en {tabla}: no se envía nada")
+        return 0
+    total = _enviar_lotes(cambios, tabla, "resolution=merge-duplicates")
+    if HASHES_SIDECAR and total == len(cambios):
+        _escribir_sidecar(tabla, cambios[0]["nombre"], hashes)
+    logger.info(f"Upsert de {total} registros nuevos/revisados en {tabla}")
+    return total
+
 # ============================
 # 🔹 Inserción 1h
-def insertar_filas(df: pd.DataFrame, tabla: str = "ohlcv_historicos"):
+def insertar_filas(df: pd.DataFrame, tabla: str = "ohlcv_historicos", solo_cambios: bool = False):
     if df.empty:
         return 0
 
@@ -174,24 +392,17 @@ def insertar_filas(df: pd.DataFrame, tabla: str = "ohlcv_historicos"):
     ]
     registros = df[columnas_validas].to_dict(orient="records")
 
-    url = f"{SUPABASE_URL}/rest/v1/{tabla}?on_conflict=nombre,time_open"
-    headers = {**HEADERS, "Prefer": "resolution=ignore-duplicates"}
+    if solo_cambios:
+        return _upsert_cambios(registros, tabla)
 
-    total_insertados = 0
-    for i in range(0, len(registros), MAX_REGISTROS_POR_LOTE):
-        lote = registros[i:i+MAX_REGISTROS_POR_LOTE]
-        r = requests.post(url, headers=headers, json=lote)
-        if not r.ok:
-            logger.error(f"Error insertando en {tabla}: {r.text}")
-            continue
-        total_insertados += len(lote)
+    total_insertados = _enviar_lotes(registros, tabla, "resolution=ignore-duplicates")
 
     logger.info(f"Insertados {total_insertados} registros nuevos en {tabla} (duplicados ignorados)")
     return total_insertados
 
 # ============================
 # 🔹 Inserción 1d
-def insertar_filas_dias(df: pd.DataFrame) -> int:
+def insertar_filas_dias(df: pd.DataFrame, solo_cambios: bool = False) -> int:
     if df.empty:
         return 0
 
@@ -211,17 +422,10 @@ def insertar_filas_dias(df: pd.DataFrame) -> int:
     ]
     registros = df[columnas_validas].to_dict(orient="records")
 
-    url = f"{SUPABASE_URL}/rest/v1/ohlcv_historicos_dias?on_conflict=nombre,time_open"
-    headers = {**HEADERS, "Prefer": "resolution=ignore-duplicates"}
+    if solo_cambios:
+        return _upsert_cambios(registros, "ohlcv_historicos_dias")
 
-    total_insertados = 0
-    for i in range(0, len(registros), MAX_REGISTROS_POR_LOTE):
-        lote = registros[i:i+MAX_REGISTROS_POR_LOTE]
-        r = requests.post(url, headers=headers, json=lote)
-        if not r.ok:
-            logger.error(f"Error insertando en ohlcv_historicos_dias: {r.text}")
-            continue
-        total_insertados += len(lote)
+    total_insertados = _enviar_lotes(registros, "ohlcv_historicos_dias", "resolution=ignore-duplicates")
 
     logger.info(f"Insertados {total_insertados} registros nuevos en ohlcv_historicos_dias (duplicados ignorados)")
     return total_insertados
@@ -310,18 +514,20 @@ def guardar_datos(moneda, dias, timeframe="1h", rellenar_huecos=True):
     if df.empty:
         return f"{moneda}: ❌ sin datos válidos"
 
-    existentes = obtener_fechas_existentes(moneda)
-    faltantes = df[~df["time_open"].isin(existentes)]
-
     if rellenar_huecos:
         expected_times = pd.date_range(start=df["time_open"].min(), end=df["time_open"].max(), freq="h", tz="UTC")
         df = df.set_index("time_open").reindex(expected_times)
         df.index.name = "time_open"
         df[["open", "high", "low", "close", "volume"]] = df[["open", "high", "low", "close", "volume"]].ffill().bfill()
         df["volume"] = df["volume"].fillna(0)
+        df["nombre"] = moneda
+        df["time_close"] = df.index + pd.to_timedelta("1h")
         df = df.reset_index()
-        inserted = insertar_filas(df)
+        # Diff por hash: solo velas nuevas o revisadas (la última vela abierta se corrige al cerrar)
+        inserted = insertar_filas(df, solo_cambios=True)
     else:
+        existentes = obtener_fechas_existentes(moneda)
+        faltantes = df[~df["time_open"].isin(existentes)]
         inserted = insertar_filas(faltantes) if not faltantes.empty else 0
 
     return f"{moneda}: ✅ completado ({inserted} registros)"
@@ -329,17 +535,21 @@ def guardar_datos(moneda, dias, timeframe="1h", rellenar_huecos=True):
 def guardar_datos_dias(moneda: str, dias: int = 90) -> dict:
     df = obtener_historicos(moneda, dias, "1d")
     if df.empty:
-        return {"moneda": moneda, "insertados": 0}
+        return {"moneda": moneda, "insertados": 0, "error": "sin datos válidos"}
 
-    url = f"{SUPABASE_URL}/rest/v1/ohlcv_historicos_dias?select=time_open&nombre=eq.{moneda}"
-    r = requests.get(url, headers=HEADERS)
-    existentes = set(pd.to_datetime(i["time_open"]).strftime("%Y-%m-%dT%H:%M:%S") for i in r.json() if "time_open" in i)
-
-    df["str_time_open"] = pd.to_datetime(df["time_open"], utc=True).dt.strftime("%Y-%m-%dT%H:%M:%S")
-    nuevos = df[~df["str_time_open"].isin(existentes)].drop(columns=["str_time_open"])
-    inserted = insertar_filas_dias(nuevos) if not nuevos.empty else 0
+    # Se pasa la ventana completa: el diff por hash descarta las velas sin cambios
+    # y corrige la vela diaria que estaba abierta en la ejecución anterior.
+    inserted = insertar_filas_dias(df, solo_cambios=True)
     return {"moneda": moneda, "insertados": int(inserted)}
 
+def ingesta_correcta(resultado) -> bool:
+    """True si el resultado de guardar_datos / guardar_datos_dias no indica fallo."""
+    if isinstance(resultado, str):
+        return "❌" not in resultado
+    if isinstance(resultado, dict):
+        return "error" not in resultado
+    return resultado is not None
+
 # ============================
 # 🔹 Utilidades fetch
 def obtener_fechas_existentes(moneda):
@@ -355,6 +565,16 @@ def _fetch_supabase(url: str) -> list:
     r.raise_for_status()
     return r.json() if isinstance(r.json(), list) else []
 
+def _fetch_supabase_paginado(url: str) -> list:
+    """Todas las filas de `url` (con `order`), pidiendo páginas de PAGINA_SUPABASE con limit/offset."""
+    filas, offset = [], 0
+    while True:
+        pagina = _fetch_supabase(f"{url}&limit={PAGINA_SUPABASE}&offset={offset}")
+        filas.extend(pagina)
+        if len(pagina) < PAGINA_SUPABASE:
+            return filas
+        offset += PAGINA_SUPABASE
+
 def cargar_horas_30d(moneda: str) -> pd.DataFrame:
     hasta = datetime.now(timezone.utc)
     desde = hasta - timedelta(days=30)
@@ -415,8 +635,13 @@ def analizar_moneda_completo(moneda: str) -> str:
         logger.error(f"Error en analizar_moneda_completo({moneda}): {e}")
         return f"*{moneda}:* Error en análisis\n\n"
 
-def resumen_completo(monedas: list) -> dict:
-    textos = [analizar_moneda_completo(m) for m in monedas]
+def resumen_completo(monedas: list, incluir_analitica: bool = False, textos_previos: dict = None) -> dict:
+    """`textos_previos` permite reutilizar textos ya renderizados ({moneda: texto}); el resto se calcula."""
+    textos_previos = textos_previos or {}
+    textos = [textos_previos.get(m) or analizar_moneda_completo(m) for m in monedas]
+    if incluir_analitica:
+        from analitica import texto_analitica  # import diferido: analitica importa este módulo
+        textos.append(texto_analitica(monedas))
     actualizado = datetime.now().strftime("%d/%m/%Y %H:%M")
     resumen_txt = ("📊 *Análisis Cripto Avanzado*\n"
                    "════════════════════════\n\n" +
@@ -1,5 +1,5 @@
 # monitor_criptos.py
-import os, io, logging, traceback, time
+import os, io, json, logging, traceback, time
 from datetime import datetime
 from flask import Flask, jsonify, request, send_file, Response
 import requests, dotenv
@@ -9,8 +9,13 @@ from historicos import (
     guardar_datos,
     guardar_datos_dias,
     resumen_completo,
-    generar_grafico
+    generar_grafico,
+    generar_dashboard,
+    generar_graficos_png
 )
+from planificador import Planificador, ejecutar_con_lease
+from analitica import analitica
+from artefactos import prerender_tras_ingesta, ruta_grafico, texto_moneda
 
 # ============================
 # Config y logger
@@ -27,6 +32,17 @@ app = Flask(__name__)
 
 # Monedas por defecto (usa las mismas que en historicos.py si quieres)
 DEFAULT_MONEDAS = os.getenv("MONEDAS", "BTC,ETH,ADA,SHIB,SOL").split(",")
+RESUMEN_ANALITICA = os.getenv("RESUMEN_ANALITICA", "false").lower() in ("1", "true", "yes")
+
+# Planificador en proceso (cada worker arranca el suyo; los leases evitan ingestas duplicadas).
+# No se arranca al importar: los procesos de render (spawn/forkserver) re-importan __main__
+# y cada uno arrancaría otro planificador. Lo arrancan gunicorn.conf.py y el bloque __main__.
+planificador = Planificador(DEFAULT_MONEDAS)
+
+def iniciar_planificador():
+    """Arranca el planificador de este proceso si PLANIFICADOR está activo."""
+    if os.getenv("PLANIFICADOR", "false").lower() in ("1", "true", "yes"):
+        planificador.iniciar()
 
 # ============================
 # Helpers Telegram
@@ -53,7 +69,7 @@ def telegram_send_message(text: str, parse_mode: str = "Markdown"):
         return {"ok": False, "error": str(e)}
 
 def telegram_send_photo(buf: io.BytesIO, caption: str = None, filename: str = "grafico.png"):
-    """Envía una imagen (BytesIO) a Telegram."""
+    """Envía una imagen (BytesIO o fichero abierto en binario) a Telegram."""
     if not TELEGRAM_TOKEN or not TELEGRAM_CHAT_ID:
         logger.warning("TELEGRAM no configurado; omito envío foto")
         return {"ok": False, "error": "telegram no configurado"}
@@ -77,6 +93,61 @@ def telegram_send_photo(buf: io.BytesIO, caption: str = None, filename: str = "g
         logger.exception("Error enviando foto a Telegram")
         return {"ok": False, "error": str(e)}
 
+TELEGRAM_MAX_ALBUM = 10   # sendMediaGroup acepta entre 2 y 10 elementos
+
+def telegram_send_media_group(imagenes: dict, caption: str = None):
+    """Envía varias imágenes ({nombre: bytes}) como un único álbum de Telegram (2 a 10 imágenes)."""
+    if not 2 <= len(imagenes) <= TELEGRAM_MAX_ALBUM:
+        return {"ok": False, "error": f"un álbum necesita entre 2 y {TELEGRAM_MAX_ALBUM} imágenes ({len(imagenes)})"}
+    if not TELEGRAM_TOKEN or not TELEGRAM_CHAT_ID:
+        logger.warning("TELEGRAM no configurado; omito envío álbum")
+        return {"ok": False, "error": "telegram no configurado"}
+
+    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMediaGroup"
+    nombres = list(imagenes)
+    media = []
+    files = {}
+    for i, nombre in enumerate(nombres):
+        item = {"type": "photo", "media": f"attach://foto{i}"}
+        if i == 0 and caption:
+            item["caption"] = caption
+        media.append(item)
+        files[f"foto{i}"] = (f"{nombre}.png", imagenes[nombre])
+    data = {"chat_id": TELEGRAM_CHAT_ID, "media": json.dumps(media)}
+
+    try:
+        r = requests.post(url, files=files, data=data, timeout=60)
+        r.raise_for_status()
+        logger.info(f"Álbum de {len(media)} fotos enviado a Telegram")
+        return r.json()
+    except Exception as e:
+        logger.exception("Error enviando álbum a Telegram")
+        return {"ok": False, "error": str(e)}
+
+def telegram_send_album(imagenes: dict, caption: str = None):
+    """
+    Envía {nombre: bytes} respetando los límites de Telegram: una sola imagen con sendPhoto,
+    y si hay más de 10, varios álbumes de hasta 10 (el caption va en el primero).
+    Devuelve (respuestas, nombres no enviados).
+    """
+    nombres = list(imagenes)
+    grupos = [nombres[i:i + TELEGRAM_MAX_ALBUM] for i in range(0, len(nombres), TELEGRAM_MAX_ALBUM)]
+    # Un último grupo de 1 no vale para sendMediaGroup: se pasa una imagen del grupo anterior
+    if len(grupos) > 1 and len(grupos[-1]) == 1:
+        grupos[-1].insert(0, grupos[-2].pop())
+
+    respuestas, no_enviadas = [], []
+    for i, grupo in enumerate(grupos):
+        texto = caption if i == 0 else None
+        if len(grupo) == 1:
+            resp = telegram_send_photo(io.BytesIO(imagenes[grupo[0]]), caption=texto, filename=f"{grupo[0]}.png")
+        else:
+            resp = telegram_send_media_group({m: imagenes[m] for m in grupo}, caption=texto)
+        respuestas.append(resp)
+        if not resp.get("ok"):
+            no_enviadas.extend(grupo)
+    return respuestas, no_enviadas
+
 # ============================
 # Endpoints
 
@@ -87,6 +158,9 @@ def index():
         "/resumen -> genera y envía resumen a Telegram\n"
         "/historicos_auto -> guarda históricos (1h y 1d) para todas las monedas\n"
         "/grafico?moneda=BTC -> genera gráfico PNG y lo devuelve\n"
+        "/dashboard?monedas=BTC,ETH -> gráficos de varias monedas en una imagen (&enviar=1 lo manda a Telegram)\n"
+        "/analytics?monedas=BTC,ETH -> correlaciones, beta a BTC, fuerza relativa y régimen de volatilidad\n"
+        "/planificador -> estado del planificador de ingesta (próxima/última ejecución)\n"
         "/health -> health check\n"
     )
 
@@ -99,15 +173,18 @@ def endpoint_resumen():
     """
     Genera resumen para las monedas por defecto (o parámetro ?monedas=BTC,ETH)
     y lo envía a Telegram. Devuelve el resultado de la operación.
+    ?analitica=1 añade la sección de contexto entre activos (por defecto RESUMEN_ANALITICA).
     """
     monedas = request.args.get("monedas")
     if monedas:
         monedas_list = [m.strip().upper() for m in monedas.split(",") if m.strip()]
     else:
         monedas_list = [m.strip().upper() for m in DEFAULT_MONEDAS]
+    incluir_analitica = request.args.get("analitica", str(RESUMEN_ANALITICA)).lower() in ("1", "true", "yes")
 
     try:
-        resumen = resumen_completo(monedas_list)
+        textos_previos = {m: texto_moneda(m) for m in monedas_list}
+        resumen = resumen_completo(monedas_list, incluir_analitica=incluir_analitica, textos_previos=textos_previos)
         texto = resumen.get("resumen_txt") if isinstance(resumen, dict) else str(resumen)
         # enviar a telegram (si está configurado)
         tg_resp = telegram_send_message(texto, parse_mode="Markdown")
@@ -138,7 +215,8 @@ def endpoint_historicos_auto():
         # --- 1h ---
         try:
             logger.info(f"Guardando históricos 1h para {moneda} (dias={dias}, rellenar={rellenar_huecos})")
-            r1 = guardar_datos(moneda=moneda, dias=dias, timeframe="1h", rellenar_huecos=rellenar_huecos)
+            _, r1 = ejecutar_con_lease(moneda, "1h", lambda: guardar_datos(
+                moneda=moneda, dias=dias, timeframe="1h", rellenar_huecos=rellenar_huecos))
             logger.info(f"Resultado guardar_datos({moneda}): {r1}")
         except Exception as e:
             logger.exception(f"Error guardando datos 1h para {moneda}")
@@ -147,12 +225,15 @@ def endpoint_historicos_auto():
         # --- 1d ---
         try:
             logger.info(f"Guardando históricos 1d para {moneda} (dias={dias_dias})")
-            r2 = guardar_datos_dias(moneda=moneda, dias=dias_dias)
+            _, r2 = ejecutar_con_lease(moneda, "1d", lambda: guardar_datos_dias(moneda=moneda, dias=dias_dias))
             logger.info(f"Resultado guardar_datos_dias({moneda}): {r2}")
         except Exception as e:
             logger.exception(f"Error guardando datos 1d para {moneda}")
             r2 = {"error": str(e)}
 
+        # Un único pre-render con los datos 1h y 1d ya guardados
+        prerender_tras_ingesta(moneda, r1, r2)
+
         resultados = {"moneda": moneda, "1h": r1, "1d": r2}
         return jsonify({"status": "ok", "resultado": resultados})
 
@@ -160,13 +241,48 @@ def endpoint_historicos_auto():
         logger.exception("Error en /historicos_auto")
         return jsonify({"status": "error", "error": str(e), "trace": traceback.format_exc()}), 500
 
+#=====================
+@app.route("/analytics", methods=["GET"])
+def endpoint_analytics():
+    """
+    Analítica entre activos (cacheada por vela).
+    Parámetros: ?monedas=BTC,ETH & ?timeframe=1h|1d & ?ventana=168 (velas de la ventana móvil)
+    """
+    monedas = request.args.get("monedas")
+    if monedas:
+        monedas_list = [m.strip().upper() for m in monedas.split(",") if m.strip()]
+    else:
+        monedas_list = [m.strip().upper() for m in DEFAULT_MONEDAS]
+    timeframe = request.args.get("timeframe", "1h")
+    if timeframe not in ("1h", "1d"):
+        return jsonify({"status": "error", "error": "timeframe debe ser 1h o 1d"}), 400
+    ventana = request.args.get("ventana")
+    if ventana is not None:
+        if not ventana.isdigit() or int(ventana) < 3:
+            return jsonify({"status": "error", "error": "ventana debe ser un entero >= 3 (velas)"}), 400
+        ventana = int(ventana)
+
+    try:
+        datos = analitica(monedas_list, timeframe=timeframe, ventana=ventana)
+        return jsonify({"status": "ok", "analitica": datos})
+    except Exception as e:
+        logger.exception("Error en /analytics")
+        return jsonify({"status": "error", "error": str(e), "trace": traceback.format_exc()}), 500
+
+#=====================
+@app.route("/planificador", methods=["GET"])
+def endpoint_planificador():
+    """Estado del planificador: próxima ejecución (de este worker) y última ejecución (compartida)."""
+    return jsonify({"status": "ok", "planificador": planificador.estado()})
+
 #=====================
 @app.route("/grafico", methods=["GET"])
 def endpoint_grafico():
     """
-    Genera gráfico PNG en memoria para una moneda.
+    Devuelve el gráfico PNG de una moneda.
     Parámetro: ?moneda=BTC & ?dias=30
-    Devuelve image/png.
+    Si hay artefacto pre-renderizado se sirve el fichero directamente (sendfile);
+    si no, se genera en memoria.
     """
     moneda = request.args.get("moneda", "").strip().upper()
     if not moneda:
@@ -174,6 +290,16 @@ def endpoint_grafico():
     dias = int(request.args.get("dias", 30))
 
     try:
+        ruta, h = ruta_grafico(moneda, dias)
+        if ruta:
+            try:
+                resp = send_file(ruta, mimetype="image/png", download_name=f"{moneda}_grafico.png",
+                                 etag=h, conditional=True)
+                resp.headers["Cache-Control"] = "no-cache"
+                return resp
+            except OSError:
+                logger.warning(f"Artefacto de {moneda} desaparecido, renderizando en memoria")
+
         buf = generar_grafico(moneda, dias=dias)
         if buf is None:
             return jsonify({"status": "error", "error": f"No hay datos para {moneda}"}), 404
@@ -194,6 +320,16 @@ def endpoint_grafico_send():
     caption = request.args.get("caption")
 
     try:
+        ruta, _ = ruta_grafico(moneda, dias)
+        if ruta:
+            try:
+                # se suben los mismos bytes que sirve /grafico, sin volver a renderizar
+                with open(ruta, "rb") as f:
+                    tg_resp = telegram_send_photo(f, caption=caption or f"{moneda} - {dias}d")
+                return jsonify({"status": "ok", "tg_response": tg_resp})
+            except OSError:
+                logger.warning(f"Artefacto de {moneda} desaparecido, renderizando en memoria")
+
         buf = generar_grafico(moneda, dias=dias)
         if buf is None:
             return jsonify({"status": "error", "error": f"No hay datos para {moneda}"}), 404
@@ -204,8 +340,53 @@ def endpoint_grafico_send():
         logger.exception("Error en /grafico_send")
         return jsonify({"status": "error", "error": str(e), "trace": traceback.format_exc()}), 500
 
+#=====================
+@app.route("/dashboard", methods=["GET"])
+def endpoint_dashboard():
+    """
+    Renderiza en paralelo los gráficos de varias monedas (?monedas=BTC,ETH, por defecto DEFAULT_MONEDAS).
+    Parámetros: ?dias=30 & ?columnas=2 & ?enviar=1 & ?modo=rejilla|album
+    Sin `enviar` devuelve la rejilla como image/png; con `enviar` la sube a Telegram en un solo envío
+    (modo=album la manda como grupo de fotos).
+    """
+    monedas = request.args.get("monedas")
+    if monedas:
+        monedas_list = [m.strip().upper() for m in monedas.split(",") if m.strip()]
+    else:
+        monedas_list = [m.strip().upper() for m in DEFAULT_MONEDAS]
+    dias = int(request.args.get("dias", 30))
+    columnas = int(request.args.get("columnas", 2))
+    enviar = request.args.get("enviar", "false").lower() in ("1", "true", "yes")
+    modo = request.args.get("modo", "rejilla").lower()
+    caption = request.args.get("caption") or f"Dashboard {', '.join(monedas_list)} - {dias}d"
+
+    try:
+        if enviar and modo == "album":
+            pngs = generar_graficos_png(monedas_list, dias=dias)
+            if not pngs:
+                return jsonify({"status": "error", "error": "No hay datos para ninguna moneda"}), 404
+            tg_resp, fallidas = telegram_send_album(pngs, caption=caption)
+            sin_datos = [m for m in monedas_list if m not in pngs]
+            no_enviadas = sin_datos + fallidas
+            status = "ok" if not fallidas else ("error" if len(fallidas) == len(pngs) else "parcial")
+            return (jsonify({"status": status, "tg_response": tg_resp, "sin_datos": sin_datos,
+                             "no_enviadas": no_enviadas}),
+                    200 if status == "ok" else 502)
+
+        buf, sin_datos = generar_dashboard(monedas_list, dias=dias, columnas=columnas)
+        if buf is None:
+            return jsonify({"status": "error", "error": "No hay datos para ninguna moneda"}), 404
+        if enviar:
+            tg_resp = telegram_send_photo(buf, caption=caption, filename="dashboard.png")
+            return jsonify({"status": "ok", "tg_response": tg_resp, "sin_datos": sin_datos})
+        return send_file(buf, mimetype="image/png", download_name="dashboard.png")
+    except Exception as e:
+        logger.exception("Error en /dashboard")
+        return jsonify({"status": "error", "error": str(e), "trace": traceback.format_exc()}), 500
+
 # ============================
 if __name__ == "__main__":
+    iniciar_planificador()
     logger.info(f"Arrancando monitor_criptos en {HOST}:{PORT}")
     app.run(host=HOST, port=PORT, debug=False)
 
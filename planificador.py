@@ -0,0 +1,278 @@
+# planificador.py
+"""
+Planificador de ingesta en proceso.
+
+Cada worker de gunicorn arranca su propio hilo, pero cada unidad de trabajo
+(moneda, timeframe) se coordina con un lease (file lock) y un fichero de estado
+compartido, así que cada cierre de vela se ingesta una sola vez aunque haya
+varios workers.
+"""
+import os, json, time, random, heapq, logging, tempfile, threading
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows (desarrollo local): solo se coordina dentro del proceso
+    fcntl = None
+
+from historicos import guardar_datos, guardar_datos_dias, ingesta_correcta
+from artefactos import prerender_tras_ingesta
+
+logger = logging.getLogger("planificador")
+
+# ============================
+# Config
+PLANIFICADOR_DIR = os.getenv("PLANIFICADOR_DIR",
+                             os.path.join(tempfile.gettempdir(), "monitor_criptos_planificador"))
+RETRASO_CIERRE_SEG = int(os.getenv("PLANIFICADOR_RETRASO_SEG", 60))  # margen tras el cierre de vela
+JITTER_SEG = int(os.getenv("PLANIFICADOR_JITTER_SEG", 30))          # reparte la carga entre monedas
+DIAS_1H = int(os.getenv("PLANIFICADOR_DIAS_1H", 7))
+DIAS_1D = int(os.getenv("PLANIFICADOR_DIAS_1D", 90))
+REINTENTO_BASE_SEG = int(os.getenv("PLANIFICADOR_REINTENTO_SEG", 60))  # backoff tras una ingesta fallida
+REINTENTO_MAX_SEG = int(os.getenv("PLANIFICADOR_REINTENTO_MAX_SEG", 900))
+
+PERIODOS = {"1h": 3600, "1d": 86400}
+PRIORIDADES = {"1h": 0, "1d": 1}   # menor = antes (si coinciden en el mismo instante)
+
+_locks_proceso = {}
+_locks_proceso_mutex = threading.Lock()
+
+# ============================
+# Helpers de tiempo
+def ultimo_cierre(timeframe: str, ahora: float = None) -> int:
+    """Epoch (s) del cierre de la última vela cerrada."""
+    periodo = PERIODOS[timeframe]
+    ahora = time.time() if ahora is None else ahora
+    return int(ahora // periodo) * periodo
+
+def _iso(ts) -> str:
+    if ts is None:
+        return None
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+# ============================
+# Lease + estado compartido
+def _ruta(moneda: str, timeframe: str, ext: str) -> str:
+    os.makedirs(PLANIFICADOR_DIR, exist_ok=True)
+    return os.path.join(PLANIFICADOR_DIR, f"{moneda}_{timeframe}.{ext}")
+
+def leer_estado(moneda: str, timeframe: str) -> dict:
+    try:
+        with open(_ruta(moneda, timeframe, "json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _escribir_estado(moneda: str, timeframe: str, estado: dict):
+    ruta = _ruta(moneda, timeframe, "json")
+    tmp = f"{ruta}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(estado, f, default=str)
+    os.replace(tmp, ruta)
+
+class _Lease:
+    """Lock exclusivo no bloqueante por (moneda, timeframe), válido entre procesos."""
+
+    def __init__(self, moneda: str, timeframe: str):
+        self.clave = f"{moneda}_{timeframe}"
+        self.ruta = _ruta(moneda, timeframe, "lock")
+        self.adquirido = False
+        self._fd = None
+        with _locks_proceso_mutex:
+            self._lock = _locks_proceso.setdefault(self.clave, threading.Lock())
+
+    def __enter__(self):
+        if not self._lock.acquire(blocking=False):
+            return self
+        if fcntl is None:
+            self.adquirido = True
+            return self
+        self._fd = os.open(self.ruta, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.adquirido = True
+        except OSError:
+            os.close(self._fd)
+            self._fd = None
+            self._lock.release()
+        return self
+
+    def __exit__(self, *exc):
+        if not self.adquirido:
+            return False
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._lock.release()
+        self.adquirido = False
+        return False
+
+def ejecutar_con_lease(moneda: str, timeframe: str, fn, slot: int = None):
+    """
+    Ejecuta fn() si se consigue el lease de (moneda, timeframe).
+    Con `slot`, además se omite si ese cierre de vela ya se ingestó en otro worker.
+    `ultimo_slot` solo avanza si la ingesta es correcta; un fallo queda registrado
+    (error, fallos consecutivos) y el cierre se puede reintentar.
+    Devuelve (ejecutado, resultado).
+    """
+    with _Lease(moneda, timeframe) as lease:
+        if not lease.adquirido:
+            logger.info(f"{moneda} {timeframe}: lease ocupado por otro worker, omito")
+            return False, {"omitido": "en curso en otro worker"}
+
+        estado = leer_estado(moneda, timeframe)
+        if slot is not None and (estado.get("ultimo_slot") or 0) >= slot:
+            return False, {"omitido": f"cierre {_iso(slot)} ya ingestado"}
+
+        inicio = time.time()
+        try:
+            resultado = fn()
+            error = None
+        except Exception as e:
+            logger.exception(f"Error en ingesta programada {moneda} {timeframe}")
+            resultado, error = {"error": str(e)}, str(e)
+
+        correcta = error is None and ingesta_correcta(resultado)
+        if correcta:
+            ultimo_slot = slot if slot is not None else ultimo_cierre(timeframe, inicio)
+            fallos = 0
+        else:
+            ultimo_slot = estado.get("ultimo_slot")
+            fallos = estado.get("fallos_consecutivos", 0) + 1
+            error = error or str(resultado)
+            logger.warning(f"{moneda} {timeframe}: ingesta fallida ({fallos} seguidas) → {error}")
+
+        estado = {
+            "ultimo_slot": ultimo_slot,
+            "ultima_ejecucion": _iso(inicio),
+            "ultima_correcta": _iso(inicio) if correcta else estado.get("ultima_correcta"),
+            "duracion_seg": round(time.time() - inicio, 2),
+            "resultado": resultado,
+            "error": None if correcta else error,
+            "fallos_consecutivos": fallos,
+            "pid": os.getpid(),
+        }
+        _escribir_estado(moneda, timeframe, estado)
+        return True, resultado
+
+# ============================
+# Planificador
+def _tarea(moneda: str, timeframe: str):
+    if timeframe == "1h":
+        def tarea():
+            resultado = guardar_datos(moneda=moneda, dias=DIAS_1H, timeframe="1h", rellenar_huecos=True)
+            prerender_tras_ingesta(moneda, resultado)
+            return resultado
+        return tarea
+
+    def tarea_dias():
+        resultado = guardar_datos_dias(moneda=moneda, dias=DIAS_1D)
+        prerender_tras_ingesta(moneda, resultado)
+        return resultado
+    return tarea_dias
+
+class Planificador:
+    """Planifica la ingesta de cada (moneda, timeframe) tras el cierre de su vela, con jitter y prioridades."""
+
+    def __init__(self, monedas: list, timeframes: tuple = ("1h", "1d")):
+        self.unidades = [(m.strip().upper(), tf) for tf in timeframes for m in monedas if m.strip()]
+        self._cola = []
+        self._proximas = {}
+        self._en_curso = None
+        self._mutex = threading.Lock()
+        self._parar = threading.Event()
+        self._hilo = None
+
+    def _programar(self, moneda: str, timeframe: str, cuando: float):
+        with self._mutex:
+            self._proximas[(moneda, timeframe)] = cuando
+            heapq.heappush(self._cola, (cuando, PRIORIDADES.get(timeframe, 9), moneda, timeframe))
+
+    def _siguiente_ejecucion(self, timeframe: str, ahora: float) -> float:
+        return ultimo_cierre(timeframe, ahora) + PERIODOS[timeframe] + RETRASO_CIERRE_SEG + random.uniform(0, JITTER_SEG)
+
+    def _tras_ejecucion(self, moneda: str, timeframe: str, ejecutado: bool, resultado, ahora: float) -> float:
+        """Próxima ejecución: reintento con backoff si la ingesta falló, o el siguiente cierre si no."""
+        siguiente = self._siguiente_ejecucion(timeframe, ahora)
+        if not ejecutado or ingesta_correcta(resultado):
+            return siguiente
+        fallos = max(1, leer_estado(moneda, timeframe).get("fallos_consecutivos", 1))
+        espera = min(REINTENTO_BASE_SEG * 2 ** (fallos - 1), REINTENTO_MAX_SEG)
+        return min(ahora + espera + random.uniform(0, JITTER_SEG), siguiente)
+
+    def iniciar(self):
+        if self._hilo and self._hilo.is_alive():
+            return
+        ahora = time.time()
+        for moneda, tf in self.unidades:
+            # Si el último cierre no se ha ingestado todavía, se recupera al arrancar
+            if (leer_estado(moneda, tf).get("ultimo_slot") or 0) < ultimo_cierre(tf, ahora):
+                self._programar(moneda, tf, ahora + random.uniform(0, JITTER_SEG))
+            else:
+                self._programar(moneda, tf, self._siguiente_ejecucion(tf, ahora))
+        self._parar.clear()
+        self._hilo = threading.Thread(target=self._bucle, name="planificador", daemon=True)
+        self._hilo.start()
+        logger.info(f"Planificador iniciado (pid {os.getpid()}) con {len(self.unidades)} unidades")
+
+    def detener(self):
+        self._parar.set()
+        if self._hilo:
+            self._hilo.join(timeout=5)
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            with self._mutex:
+                if not self._cola:
+                    cuando = None
+                else:
+                    cuando, _, moneda, tf = self._cola[0]
+            if cuando is None:
+                self._parar.wait(60)
+                continue
+            espera = cuando - time.time()
+            if espera > 0:
+                self._parar.wait(min(espera, 60))
+                continue
+
+            with self._mutex:
+                heapq.heappop(self._cola)
+                self._en_curso = (moneda, tf)
+            ejecutado, resultado = False, None
+            try:
+                ejecutado, resultado = ejecutar_con_lease(moneda, tf, _tarea(moneda, tf),
+                                                          slot=ultimo_cierre(tf, cuando))
+                if ejecutado:
+                    logger.info(f"Ingesta programada {moneda} {tf}: {resultado}")
+            finally:
+                with self._mutex:
+                    self._en_curso = None
+                self._programar(moneda, tf, self._tras_ejecucion(moneda, tf, ejecutado, resultado, time.time()))
+
+    def estado(self) -> dict:
+        with self._mutex:
+            proximas = dict(self._proximas)
+            en_curso = self._en_curso
+        unidades = []
+        for moneda, tf in self.unidades:
+            compartido = leer_estado(moneda, tf)
+            unidades.append({
+                "moneda": moneda,
+                "timeframe": tf,
+                "prioridad": PRIORIDADES.get(tf, 9),
+                "proxima_ejecucion": _iso(proximas.get((moneda, tf))),
+                "ultima_ejecucion": compartido.get("ultima_ejecucion"),
+                "ultimo_cierre_ingestado": _iso(compartido.get("ultimo_slot")),
+                "duracion_seg": compartido.get("duracion_seg"),
+                "resultado": compartido.get("resultado"),
+                "error": compartido.get("error"),
+                "fallos_consecutivos": compartido.get("fallos_consecutivos", 0),
+                "ejecutado_por_pid": compartido.get("pid"),
+                "en_curso": en_curso == (moneda, tf),
+            })
+        return {
+            "activo": bool(self._hilo and self._hilo.is_alive()),
+            "pid": os.getpid(),
+            "unidades": unidades,
+        }
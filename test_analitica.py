@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import analitica
+
+
+@pytest.fixture
+def rendimientos():
+    rng = np.random.default_rng(7)
+    base = rng.normal(0, 0.01, size=(200, 1))
+    return base * np.array([1.0, 1.5, -0.5, 0.2]) + rng.normal(0, 0.005, size=(200, 4))
+
+
+def test_correlacion_coincide_con_corrcoef(rendimientos):
+    np.testing.assert_allclose(analitica._correlacion(rendimientos), np.corrcoef(rendimientos, rowvar=False),
+                               atol=1e-12)
+
+
+def test_correlacion_con_historial_parcial(rendimientos):
+    datos = rendimientos.copy()
+    datos[:150, 2] = np.nan          # moneda listada hace poco: solo 50 filas
+    datos[::7, 1] = np.nan           # huecos sueltos
+    datos[:-2, 3] = np.nan           # menos de 3 observaciones
+
+    corr = analitica._correlacion(datos)
+    for i in range(3):
+        for j in range(3):
+            comunes = ~np.isnan(datos[:, i]) & ~np.isnan(datos[:, j])
+            esperada = np.corrcoef(datos[comunes, i], datos[comunes, j])[0, 1]
+            assert corr[i, j] == pytest.approx(esperada, abs=1e-12)
+    assert np.isnan(corr[3]).all() and np.isnan(corr[:, 3]).all()
+
+
+def test_beta_y_correlacion_de_la_ultima_ventana(rendimientos):
+    precios = 100 * np.exp(np.cumsum(np.vstack([np.zeros((1, 4)), rendimientos]), axis=0))
+    indice = pd.date_range("2024-01-01", periods=len(precios), freq="h", tz="UTC")
+    cierres = pd.DataFrame(precios, index=indice, columns=["BTC", "ETH", "ADA", "SOL"])
+    cierres.iloc[:120, 2] = np.nan   # ADA sin historia al principio de la ventana
+
+    datos = analitica.calcular_analitica(cierres, "1h", ventana=100, referencia="BTC")
+    ultima = rendimientos[-100:]
+    for j, m in [(1, "ETH"), (3, "SOL")]:
+        beta = np.cov(ultima[:, j], ultima[:, 0], ddof=0)[0, 1] / np.var(ultima[:, 0])
+        assert datos["por_moneda"][m]["beta_referencia"] == pytest.approx(beta, abs=1e-6)
+        assert datos["por_moneda"][m]["corr_referencia"] == pytest.approx(np.corrcoef(ultima[:, j], ultima[:, 0])[0, 1],
+                                                                          abs=1e-6)
+
+    comunes = rendimientos[-80:]     # ADA solo tiene las 80 últimas filas de la ventana
+    beta_ada = np.cov(comunes[:, 2], comunes[:, 0], ddof=0)[0, 1] / np.var(comunes[:, 0])
+    assert datos["por_moneda"]["ADA"]["beta_referencia"] == pytest.approx(beta_ada, abs=1e-6)
+    assert datos["por_moneda"]["BTC"]["beta_referencia"] == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("ventana", ["-5", "0", "2", "abc", "1.5"])
+def test_ventana_invalida_devuelve_400(ventana):
+    from monitor_criptos import app
+    r = app.test_client().get(f"/analytics?ventana={ventana}")
+    assert r.status_code == 400
+    assert r.get_json()["status"] == "error"
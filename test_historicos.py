@@ -0,0 +1,84 @@
+import json
+from decimal import Decimal, ROUND_HALF_UP
+
+import pytest
+
+import historicos
+
+
+class AlmacenFalso:
+    """Tabla OHLCV simulada: guarda como Postgres numeric con 8 decimales y devuelve JSON numbers."""
+
+    def __init__(self):
+        self.filas = {}
+        self.enviadas = []
+
+    def _guardar(self, fila: dict) -> dict:
+        texto = json.loads(json.dumps(fila), parse_float=Decimal)
+        guardada = {}
+        for c, v in texto.items():
+            if isinstance(v, Decimal):
+                v = float(v.quantize(Decimal("1E-8"), rounding=ROUND_HALF_UP))
+            guardada[c] = v
+        return guardada
+
+    def enviar_lotes(self, registros, tabla, prefer):
+        self.enviadas.append(len(registros))
+        for r in registros:
+            self.filas[(tabla, r["nombre"], r["time_open"])] = self._guardar(r)
+        return len(registros)
+
+    def fetch_paginado(self, url):
+        return [f for (tabla, _, _), f in sorted(self.filas.items()) if f"/{tabla}?" in url]
+
+
+@pytest.fixture(params=[False, True], ids=["supabase", "sidecar"])
+def almacen(request, tmp_path, monkeypatch):
+    falso = AlmacenFalso()
+    monkeypatch.setattr(historicos, "_enviar_lotes", falso.enviar_lotes)
+    monkeypatch.setattr(historicos, "_fetch_supabase_paginado", falso.fetch_paginado)
+    monkeypatch.setattr(historicos, "HASHES_SIDECAR", str(tmp_path / "hashes") if request.param else None)
+    return falso
+
+
+def _velas(n: int, base: float = 43251.0, paso: float = 1.1) -> list:
+    velas = []
+    for i in range(n):
+        precio = base + i * paso + 0.123456785
+        velas.append({
+            "nombre": "BTC",
+            "time_open": f"2024-01-{1 + i // 24:02d}T{i % 24:02d}:00:00Z",
+            "open": precio, "high": precio * 1.01, "low": precio * 0.99, "close": precio / 3,
+            "volume": 12.3456789012345 * (i + 1),
+        })
+    return velas
+
+
+def test_solo_se_reenvian_velas_nuevas_o_revisadas(almacen):
+    velas = _velas(60)
+    assert historicos._upsert_cambios(velas, "ohlcv_historicos") == 60
+    assert historicos._upsert_cambios(velas, "ohlcv_historicos") == 0
+
+    # La última vela (abierta) se revisa al cerrar: solo esa se reenvía
+    revisadas = [dict(v) for v in velas]
+    revisadas[-1]["close"] += 5.0
+    revisadas[-1]["volume"] *= 2
+    cambios, _ = historicos._filtrar_cambios(revisadas, "ohlcv_historicos")
+    assert [c["time_open"] for c in cambios] == [velas[-1]["time_open"]]
+    assert historicos._upsert_cambios(revisadas, "ohlcv_historicos") == 1
+    assert almacen.enviadas == [60, 1]
+
+
+@pytest.mark.parametrize("base, paso", [(43251.0, 1.1), (0.000012345, 1e-9), (0.4567, 0.000123456785)])
+def test_redondeo_del_almacen_no_cuenta_como_cambio(almacen, base, paso):
+    velas = _velas(72, base, paso)
+    historicos._upsert_cambios(velas, "ohlcv_historicos")
+    cambios, _ = historicos._filtrar_cambios(velas, "ohlcv_historicos")
+    assert len(cambios) == 0
+
+
+def test_hash_fila_normaliza_a_la_escala_guardada():
+    fila = {"open": 0.123456785, "high": 1e-05, "low": -0.0, "close": 100, "volume": None}
+    guardada = {"open": 0.12345679, "high": 0.00001, "low": 0.0, "close": 100.0, "volume": None}
+    assert historicos._hash_fila(fila) == historicos._hash_fila(guardada)
+    assert historicos._hash_fila({**fila, "close": 100.00000001}) != historicos._hash_fila(guardada)
@@ -0,0 +1,75 @@
+import time
+
+import pytest
+
+import planificador
+
+
+@pytest.fixture(autouse=True)
+def dir_temporal(tmp_path, monkeypatch):
+    monkeypatch.setattr(planificador, "PLANIFICADOR_DIR", str(tmp_path))
+    monkeypatch.setattr(planificador, "JITTER_SEG", 0)
+
+
+def _fallo():
+    raise RuntimeError("kraken down")
+
+
+@pytest.mark.parametrize("fn", [
+    _fallo,
+    lambda: "BTC: ❌ sin datos válidos",
+    lambda: {"moneda": "BTC", "insertados": 0, "error": "sin datos válidos"},
+])
+def test_fallo_no_avanza_slot_y_se_reintenta(fn):
+    slot = planificador.ultimo_cierre("1d")
+
+    ejecutado, _ = planificador.ejecutar_con_lease("BTC", "1d", fn, slot=slot)
+    estado = planificador.leer_estado("BTC", "1d")
+    assert ejecutado
+    assert estado.get("ultimo_slot") is None
+    assert estado["error"]
+    assert estado["fallos_consecutivos"] == 1
+    assert estado["ultima_ejecucion"]
+
+    # El mismo cierre se vuelve a ejecutar y, si va bien, queda ingestado
+    ejecutado, resultado = planificador.ejecutar_con_lease("BTC", "1d", lambda: "BTC: ✅ completado (3 registros)",
+                                                           slot=slot)
+    estado = planificador.leer_estado("BTC", "1d")
+    assert ejecutado and resultado.startswith("BTC: ✅")
+    assert estado["ultimo_slot"] == slot
+    assert estado["error"] is None
+    assert estado["fallos_consecutivos"] == 0
+
+    ejecutado, resultado = planificador.ejecutar_con_lease("BTC", "1d", lambda: "no debería ejecutarse", slot=slot)
+    assert not ejecutado and "ya ingestado" in resultado["omitido"]
+
+
+def test_reintento_con_backoff_dentro_del_mismo_cierre(monkeypatch):
+    monkeypatch.setattr(planificador, "REINTENTO_BASE_SEG", 60)
+    monkeypatch.setattr(planificador, "REINTENTO_MAX_SEG", 900)
+    plan = planificador.Planificador(["BTC"], timeframes=("1d",))
+    ahora = planificador.ultimo_cierre("1d") + 120
+
+    esperas = []
+    for _ in range(3):
+        ejecutado, resultado = planificador.ejecutar_con_lease("BTC", "1d", _fallo, slot=planificador.ultimo_cierre("1d"))
+        esperas.append(plan._tras_ejecucion("BTC", "1d", ejecutado, resultado, ahora) - ahora)
+    assert esperas == [60, 120, 240]
+
+    # Una ingesta correcta vuelve a planificar tras el siguiente cierre
+    siguiente = plan._tras_ejecucion("BTC", "1d", True, "BTC: ✅ completado (1 registros)", ahora)
+    assert siguiente >= planificador.ultimo_cierre("1d") + planificador.PERIODOS["1d"]
+
+
+def test_arranque_recupera_cierre_fallido(monkeypatch):
+    monkeypatch.setattr(planificador, "_tarea", lambda moneda, tf: lambda: f"{moneda}: ✅ completado (0 registros)")
+    planificador.ejecutar_con_lease("BTC", "1h", _fallo, slot=planificador.ultimo_cierre("1h"))
+    plan = planificador.Planificador(["BTC"], timeframes=("1h",))
+    try:
+        plan.iniciar()
+        limite = time.time() + 5
+        while planificador.leer_estado("BTC", "1h").get("ultimo_slot") is None and time.time() < limite:
+            time.sleep(0.05)
+        assert planificador.leer_estado("BTC", "1h")["ultimo_slot"] == planificador.ultimo_cierre("1h")
+    finally:
+        plan.detener()